@@ -1,30 +1,48 @@
+import asyncio
+import hashlib
 import os
 import random
-import string
+import secrets
+import time
+from datetime import datetime, timezone
 from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException
+import orjson
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from pymongo import UpdateOne
 
-from database import db, create_document, get_documents
-from schemas import Question, Room, Message, Match
+from database import db, redis_client, create_document, get_documents
+from schemas import Question, Room, Message
 
-app = FastAPI(title="1v1 DSA Coding Platform API")
+app = FastAPI(title="1v1 DSA Coding Platform API", default_response_class=ORJSONResponse)
+
+# Level 1 keeps CPU cost low; the size floor skips tiny {"ok": true}
+# style bodies where compression doesn't pay
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=1)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=[os.getenv("FRONTEND_ORIGIN", "https://app.example.com")],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=86400,
 )
 
 
 # --------- Utility helpers ---------
 
-def _gen_room_id(n: int = 6) -> str:
-    return "".join(random.choices(string.ascii_uppercase + string.digits, k=n))
+# Matchmaking queue key and how long a queued joiner stays valid
+_WAITING_KEY = "mm:waiting"
+_WAITING_MAX_AGE = 60.0
+
+
+def _gen_room_id() -> str:
+    return secrets.token_urlsafe(5)
 
 
 def _get_collection(name: str):
@@ -33,6 +51,83 @@ def _get_collection(name: str):
     return db[name]
 
 
+def _get_redis():
+    if redis_client is None:
+        raise HTTPException(status_code=500, detail="Redis not available")
+    return redis_client
+
+
+# Slugs of all questions, loaded once and refreshed on seeding; picking a
+# random question from this list avoids a $sample aggregation per match
+_question_slugs: List[str] = []
+
+
+async def _get_question_slugs() -> List[str]:
+    if not _question_slugs:
+        docs = await _get_collection("question").find({}, {"slug": 1, "_id": 0}).to_list(length=None)
+        _question_slugs.extend(d["slug"] for d in docs)
+    return _question_slugs
+
+
+# Buffered message writes: send_message enqueues and returns, a background
+# task flushes batches with one insert_many instead of one RTT per message
+_MSG_BATCH_MAX = 200
+_MSG_FLUSH_INTERVAL = 0.05
+_msg_queue: asyncio.Queue = asyncio.Queue()
+
+
+async def _flush_messages():
+    while True:
+        batch = [await _msg_queue.get()]
+        try:
+            while len(batch) < _MSG_BATCH_MAX:
+                batch.append(_msg_queue.get_nowait())
+        except asyncio.QueueEmpty:
+            pass
+        try:
+            await db.message.insert_many(batch, ordered=False)
+        except Exception:
+            # Keep the flusher alive; a failed batch is lost but the next
+            # flush proceeds
+            pass
+        await asyncio.sleep(_MSG_FLUSH_INTERVAL)
+
+
+# Editor state lives in Redis (one write per keystroke is too hot for
+# Mongo); dirty rooms are snapshotted back in bulk every few seconds
+_EDITOR_SNAPSHOT_INTERVAL = 5.0
+
+
+async def _snapshot_editors():
+    while True:
+        await asyncio.sleep(_EDITOR_SNAPSHOT_INTERVAL)
+        try:
+            dirty = await redis_client.spop("rooms:dirty", 256)
+            if not dirty:
+                continue
+            ops = []
+            for rid in dirty:
+                rid = rid.decode()
+                content = await redis_client.get(f"room:{rid}:editor")
+                if content is not None:
+                    ops.append(UpdateOne({"room_id": rid}, {"$set": {"editor_content": content.decode()}}))
+            if ops:
+                await db.room.bulk_write(ops, ordered=False)
+        except Exception:
+            pass
+
+
+async def _pop_waiting(r):
+    """Atomically pop the next waiting joiner, skipping stale entries."""
+    while True:
+        entry = await r.lpop(_WAITING_KEY)
+        if entry is None:
+            return None
+        name, _, queued_at = entry.decode().rpartition("|")
+        if time.time() - float(queued_at) <= _WAITING_MAX_AGE:
+            return name
+
+
 # --------- Request models ---------
 
 class JoinPayload(BaseModel):
@@ -46,6 +141,28 @@ class UpdateEditorPayload(BaseModel):
     content: str
 
 
+# --------- Startup ---------
+
+@app.on_event("startup")
+async def create_indexes():
+    if db is None:
+        return
+    await db.room.create_index("room_id", unique=True, background=True)
+    await db.question.create_index("slug", unique=True, background=True)
+    # Covers the get_messages filter + sort so the limit(50) walks the
+    # index in order instead of sorting in memory
+    await db.message.create_index([("room_id", 1), ("created_at", 1)], name="room_time", background=True)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    if db is not None:
+        asyncio.create_task(_flush_messages())
+    if db is not None and redis_client is not None:
+        asyncio.create_task(_snapshot_editors())
+        asyncio.create_task(_pair_joiners())
+
+
 # --------- Health ---------
 
 @app.get("/")
@@ -54,7 +171,7 @@ def root():
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -69,7 +186,7 @@ def test_database():
             response["database_name"] = getattr(db, "name", "✅ Connected")
             response["connection_status"] = "Connected"
             try:
-                response["collections"] = db.list_collection_names()
+                response["collections"] = await db.list_collection_names()
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
                 response["database"] = f"⚠️ Connected but Error: {str(e)[:50]}"
@@ -83,136 +200,277 @@ def test_database():
 
 # --------- Questions ---------
 
-@app.get("/api/questions", response_model=List[Question])
-def list_questions():
+# No response_model: the docs come out of Mongo already in response
+# shape, so re-validating them through Pydantic per request is pure CPU
+@app.get("/api/questions")
+async def list_questions(request: Request):
+    body = etag = None
+    if redis_client is not None:
+        cached_body, cached_etag = await redis_client.mget("questions:all", "questions:all:etag")
+        if cached_body is not None and cached_etag is not None:
+            body, etag = cached_body, cached_etag.decode()
+    if body is None:
+        col = _get_collection("question")
+        docs = await col.find({}, {"_id": 0}).to_list(length=None)
+        body = orjson.dumps(docs)
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        if redis_client is not None:
+            await redis_client.set("questions:all", body, ex=300)
+            await redis_client.set("questions:all:etag", etag, ex=300)
+    # Unchanged content: no body, browser/CDN reuses its copy
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304)
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "public, max-age=300"},
+    )
+
+
+@app.get("/api/questions/summary")
+async def list_question_summaries():
+    # List views only need the headline fields, not the markdown statement
     col = _get_collection("question")
-    docs = list(col.find({}, {"_id": 0}))
+    docs = await col.find(
+        {}, {"_id": 0, "title": 1, "slug": 1, "difficulty": 1, "tags": 1}
+    ).to_list(length=None)
     return docs
 
 
-@app.post("/api/seed-questions")
-def seed_questions():
-    col = _get_collection("question")
-    if col.count_documents({}) > 0:
-        return {"seeded": False, "message": "Questions already exist"}
-    samples: List[Question] = [
-        Question(
-            title="Two Sum",
-            slug="two-sum",
-            difficulty="Easy",
-            tags=["array", "hashmap"],
-            statement=(
-                "Given an array of integers nums and an integer target, return indices of the"
-                " two numbers such that they add up to target."
-            ),
-            examples=[{"input": "nums=[2,7,11,15], target=9", "output": "[0,1]"}],
+# Built once at import; seed_questions reuses it on every call
+_SEED_QUESTIONS: List[Question] = [
+    Question(
+        title="Two Sum",
+        slug="two-sum",
+        difficulty="Easy",
+        tags=["array", "hashmap"],
+        statement=(
+            "Given an array of integers nums and an integer target, return indices of the"
+            " two numbers such that they add up to target."
         ),
-        Question(
-            title="Valid Parentheses",
-            slug="valid-parentheses",
-            difficulty="Easy",
-            tags=["stack", "string"],
-            statement=(
-                "Given a string s containing only the characters '()[]{}', determine if the"
-                " input string is valid."
-            ),
-            examples=[{"input": "s=()[]{}", "output": "true"}],
+        examples=[{"input": "nums=[2,7,11,15], target=9", "output": "[0,1]"}],
+    ),
+    Question(
+        title="Valid Parentheses",
+        slug="valid-parentheses",
+        difficulty="Easy",
+        tags=["stack", "string"],
+        statement=(
+            "Given a string s containing only the characters '()[]{}', determine if the"
+            " input string is valid."
         ),
-        Question(
-            title="Longest Substring Without Repeating Characters",
-            slug="longest-substring",
-            difficulty="Medium",
-            tags=["hashmap", "sliding-window"],
-            statement=(
-                "Given a string s, find the length of the longest substring without repeating characters."
-            ),
-            examples=[{"input": "abcabcbb", "output": "3"}],
+        examples=[{"input": "s=()[]{}", "output": "true"}],
+    ),
+    Question(
+        title="Longest Substring Without Repeating Characters",
+        slug="longest-substring",
+        difficulty="Medium",
+        tags=["hashmap", "sliding-window"],
+        statement=(
+            "Given a string s, find the length of the longest substring without repeating characters."
         ),
-    ]
-    for q in samples:
-        create_document("question", q)
-    return {"seeded": True, "count": len(samples)}
+        examples=[{"input": "abcabcbb", "output": "3"}],
+    ),
+]
+
+
+@app.post("/api/seed-questions")
+async def seed_questions():
+    col = _get_collection("question")
+    # Metadata read, not a scan; good enough for a seed guard
+    if await col.estimated_document_count() > 0:
+        return {"seeded": False, "message": "Questions already exist"}
+    # One round-trip for the whole batch; ordered=False so a duplicate
+    # slug doesn't abort the remaining inserts
+    now = datetime.now(timezone.utc)
+    await col.insert_many(
+        [{**q.model_dump(), "created_at": now, "updated_at": now} for q in _SEED_QUESTIONS],
+        ordered=False,
+    )
+    if redis_client is not None:
+        await redis_client.delete("questions:all")
+    _question_slugs[:] = [q.slug for q in _SEED_QUESTIONS]
+    return {"seeded": True, "count": len(_SEED_QUESTIONS)}
 
 
 # --------- Matchmaking & Rooms ---------
 
+# Joiners are paired by one background task: handlers enqueue (name,
+# future) and await; the pairer drains bursts and persists all new rooms
+# and system messages with one insert_many each
+_JOIN_BATCH_MAX = 32
+_JOIN_GATHER_TIMEOUT = 0.02
+_join_queue: asyncio.Queue = asyncio.Queue()
+
+
+async def _pair_joiners():
+    while True:
+        joiners = [await _join_queue.get()]
+        try:
+            while len(joiners) < _JOIN_BATCH_MAX:
+                joiners.append(await asyncio.wait_for(_join_queue.get(), timeout=_JOIN_GATHER_TIMEOUT))
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await _pair_batch(joiners)
+        except Exception as exc:
+            for _, fut in joiners:
+                if not fut.done():
+                    fut.set_exception(exc)
+
+
+async def _pair_batch(joiners):
+    r = redis_client
+    slugs = await _get_question_slugs()
+    now = datetime.now(timezone.utc)
+    rooms, messages, paired = [], [], []
+
+    idx = 0
+    while idx < len(joiners):
+        name, fut = joiners[idx]
+        if idx + 1 < len(joiners):
+            # Pair adjacent joiners from the same burst
+            partner, partner_fut = joiners[idx + 1]
+            participants, futs = [name, partner], [fut, partner_fut]
+            idx += 2
+        else:
+            # Odd one out: fall back to the cross-request waiting queue
+            idx += 1
+            partner = await _pop_waiting(r)
+            if partner is None:
+                await r.rpush(_WAITING_KEY, f"{name}|{time.time()}")
+                fut.set_result({"status": "waiting"})
+                continue
+            participants, futs = [partner, name], [fut]
+
+        # SADD returns 0 on a duplicate id, so retry until unique; this
+        # also registers the room in rooms:active
+        while not await r.sadd("rooms:active", room_id := _gen_room_id()):
+            pass
+        room = Room(
+            room_id=room_id,
+            participants=participants,
+            question_slug=random.choice(slugs) if slugs else None,
+            editor_content="",
+        ).model_dump()
+        room["created_at"] = room["updated_at"] = now
+        rooms.append(room)
+        msg = Message(room_id=room_id, sender="system", content="Match found!", type="system").model_dump()
+        msg["created_at"] = msg["updated_at"] = now
+        messages.append(msg)
+        await r.set(f"room:{room_id}:editor", "")
+        paired.append((futs, room_id))
+
+    if rooms:
+        await db.room.insert_many(rooms, ordered=False)
+        await db.message.insert_many(messages, ordered=False)
+    # Resolve only after the rooms are persisted so a paired client
+    # can't GET a room that doesn't exist yet
+    for futs, room_id in paired:
+        for fut in futs:
+            if not fut.done():
+                fut.set_result({"status": "paired", "room_id": room_id})
+
+
 @app.post("/api/matchmaking/join")
-def matchmaking_join(payload: JoinPayload):
+async def matchmaking_join(payload: JoinPayload):
     name = payload.name.strip()
     if not name:
         raise HTTPException(status_code=400, detail="Name is required")
 
-    match_col = _get_collection("match")
-
-    # Try to find another waiting user
-    other = match_col.find_one({"status": "waiting"})
-    if other is None:
-        # Put this user in waiting queue
-        create_document("match", Match(name=name).model_dump())
-        return {"status": "waiting"}
-
-    # Pair and create room
-    room_id = _gen_room_id()
-
-    # Choose a random question
-    q_col = _get_collection("question")
-    qdoc = q_col.aggregate([{ "$sample": {"size": 1}}])
-    q = next(qdoc, None)
-    question_slug = q.get("slug") if q else None
-
-    room = Room(
-        room_id=room_id,
-        participants=[other["name"], name],
-        question_slug=question_slug,
-        editor_content="",
-    )
-    create_document("room", room)
+    # Fail fast if a backing store is missing; otherwise the future
+    # would never resolve
+    _get_collection("room")
+    _get_redis()
 
-    # Update other match and remove waiting entries for both
-    match_col.delete_one({"_id": other["_id"]})
+    fut = asyncio.get_running_loop().create_future()
+    await _join_queue.put((name, fut))
+    return await fut
 
-    # System message
-    create_document("message", Message(room_id=room_id, sender="system", content="Match found!", type="system"))
 
-    return {"status": "paired", "room_id": room_id}
+@app.get("/api/room/{room_id}")
+async def get_room(room_id: str):
+    doc = None
+    if redis_client is not None:
+        cached = await redis_client.get(f"room:{room_id}")
+        if cached is not None:
+            doc = orjson.loads(cached)
+    if doc is None:
+        doc = await _fetch_room(room_id)
+    # Redis holds the live editor state; overlay it so responses are
+    # fresher than the 5s cache/snapshot cadence
+    if redis_client is not None:
+        content = await redis_client.get(f"room:{room_id}:editor")
+        if content is not None:
+            doc["editor_content"] = content.decode()
+    return doc
 
 
-@app.get("/api/room/{room_id}")
-def get_room(room_id: str):
+async def _fetch_room(room_id: str) -> dict:
     col = _get_collection("room")
-    doc = col.find_one({"room_id": room_id}, {"_id": 0})
-    if not doc:
+    # Join the question in the same round-trip instead of a second find_one
+    pipeline = [
+        {"$match": {"room_id": room_id}},
+        {"$lookup": {
+            "from": "question",
+            "localField": "question_slug",
+            "foreignField": "slug",
+            "as": "question",
+        }},
+        {"$unwind": {"path": "$question", "preserveNullAndEmptyArrays": True}},
+        {"$project": {"_id": 0, "question._id": 0}},
+    ]
+    docs = await col.aggregate(pipeline).to_list(length=1)
+    if not docs:
         raise HTTPException(status_code=404, detail="Room not found")
-    # Also include question data
-    if doc.get("question_slug"):
-        q = _get_collection("question").find_one({"slug": doc["question_slug"]}, {"_id": 0})
-        doc["question"] = q
-    else:
-        doc["question"] = None
+    doc = docs[0]
+    doc.setdefault("question", None)
+    if redis_client is not None:
+        # Rooms change often (editor/messages), so keep the TTL short
+        await redis_client.set(f"room:{room_id}", orjson.dumps(doc), ex=5)
     return doc
 
 
 @app.get("/api/room/{room_id}/messages")
-def get_messages(room_id: str, limit: int = 50):
+async def get_messages(room_id: str, limit: int = 50):
     col = _get_collection("message")
-    docs = list(col.find({"room_id": room_id}, {"_id": 0}).sort("created_at", 1).limit(limit))
+    # The caller already knows the room_id; don't echo it back N times.
+    # Hinting room_time pins the planner to the compound index so the
+    # sort is an in-order index walk and limit() stops after 50 keys
+    docs = (
+        await col.find({"room_id": room_id}, {"_id": 0, "room_id": 0})
+        .sort("created_at", 1)
+        .limit(limit)
+        .hint("room_time")
+        .to_list(length=limit)
+    )
     return docs
 
 
 @app.post("/api/room/{room_id}/messages")
-def send_message(room_id: str, payload: SendMessagePayload):
-    # Validate room exists
-    r = _get_collection("room").find_one({"room_id": room_id})
-    if not r:
+async def send_message(room_id: str, payload: SendMessagePayload):
+    # O(1) membership check against rooms:active instead of a Mongo find_one
+    r = _get_redis()
+    if not await r.sismember("rooms:active", room_id):
         raise HTTPException(status_code=404, detail="Room not found")
-    create_document("message", Message(room_id=room_id, sender=payload.sender, content=payload.content))
+    # Stamp timestamps at enqueue time so ordering reflects arrival
+    msg = Message(room_id=room_id, sender=payload.sender, content=payload.content).model_dump()
+    now = datetime.now(timezone.utc)
+    msg["created_at"] = now
+    msg["updated_at"] = now
+    await _msg_queue.put(msg)
+    if redis_client is not None:
+        await redis_client.delete(f"room:{room_id}")
     return {"ok": True}
 
 
 @app.put("/api/room/{room_id}/editor")
-def update_editor(room_id: str, payload: UpdateEditorPayload):
-    col = _get_collection("room")
-    res = col.update_one({"room_id": room_id}, {"$set": {"editor_content": payload.content}})
-    if res.matched_count == 0:
+async def update_editor(room_id: str, payload: UpdateEditorPayload):
+    r = _get_redis()
+    if not await r.sismember("rooms:active", room_id):
         raise HTTPException(status_code=404, detail="Room not found")
+    # Per-keystroke writes stay in Redis; _snapshot_editors persists
+    # dirty rooms to Mongo in bulk
+    await r.set(f"room:{room_id}:editor", payload.content)
+    await r.sadd("rooms:dirty", room_id)
     return {"ok": True}